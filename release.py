@@ -1,35 +1,41 @@
 import argparse
+import asyncio
+import atexit
+import functools
 from getpass import getpass
 from io import TextIOBase
 import logging
 import logging.config
-import re
-from shlex import quote
+from logging.handlers import MemoryHandler, QueueHandler, QueueListener
+import queue
+from shlex import join, quote
 import subprocess
 import sys
+import threading
 from types import TracebackType
-from typing import List, NamedTuple, Optional, Type, cast
+from typing import Callable, List, NamedTuple, Optional, Tuple, Type, Union, cast
 
+from packaging.version import InvalidVersion, Version
 import subprocess_tee
 
 from skippex.cmd import EXIT_UNAUTHORIZED
 
+logger = logging.getLogger(__name__)
 
-# Disable third-party loggers.
-# Make sure this is done before defining any local logger.
-logging.config.dictConfig(
-    {
-        "version": 1,
-        "disable_existing_loggers": True,
-    }
-)
+# Commands given as a list of arguments don't need any quoting. They skip the
+# shell when run concurrently; subprocess_tee always goes through one, but
+# quotes them for us.
+Cmd = Union[str, List[str]]
 
-logger = logging.getLogger(__name__)
 
-# Reference: https://semver.org/
-re_semver = re.compile(
-    r"^(0|[1-9]\d*)\.(0|[1-9]\d*)\.(0|[1-9]\d*)(?:-((?:0|[1-9]\d*|\d*[a-zA-Z-][0-9a-zA-Z-]*)(?:\.(?:0|[1-9]\d*|\d*[a-zA-Z-][0-9a-zA-Z-]*))*))?(?:\+([0-9a-zA-Z-]+(?:\.[0-9a-zA-Z-]+)*))?$"
-)
+@functools.lru_cache(maxsize=None)
+def _git_query(args: Tuple[str, ...]) -> str:
+    """Returns the stdout of a read-only git command, cached for the whole run."""
+    return subprocess.run(["git", *args], capture_output=True, check=True, text=True).stdout
+
+
+def _format_cmd(cmd: Cmd) -> str:
+    return cmd if isinstance(cmd, str) else join(cmd)
 
 
 class Rollback(Exception):
@@ -37,29 +43,89 @@ class Rollback(Exception):
 
 
 class Command(NamedTuple):
-    commit: str
-    rollback: Optional[str]
+    commit: Cmd
+    rollback: Optional[Cmd]
     pure: bool
 
 
 class Transaction:
     def __init__(self) -> None:
-        self._executed: List[Command] = []
+        # Non-pure commands executed so far, i.e. the ones that need rolling
+        # back (or reporting when they can't be).
+        self._rollbackable: List[Command] = []
         self.committed: Optional[bool] = None
 
-    def _execute(self, cmd: str, check: bool = True) -> subprocess.CompletedProcess:
-        logger.info(f"--> {cmd}")
-        p = subprocess_tee.run(cmd, shell=True)
+    def _execute(self, cmd: Cmd, check: bool = True) -> subprocess.CompletedProcess:
+        logger.info(f"--> {_format_cmd(cmd)}")
+        p = subprocess_tee.run(cmd)
+        # Log the command's output before whatever comes next.
+        sys.stdout.flush()
+        sys.stderr.flush()
         if check:
             # check=True isn't supported by subprocess_tee.run():
             # https://github.com/pycontribs/subprocess-tee/issues/26
             p.check_returncode()
         return p
 
+    async def _execute_async(self, cmd: Cmd) -> subprocess.CompletedProcess:
+        pipe = asyncio.subprocess.PIPE
+        if isinstance(cmd, str):
+            proc = await asyncio.create_subprocess_shell(cmd, stdout=pipe, stderr=pipe)
+        else:
+            proc = await asyncio.create_subprocess_exec(*cmd, stdout=pipe, stderr=pipe)
+        stdout, stderr = await proc.communicate()
+        return subprocess.CompletedProcess(
+            cmd, cast(int, proc.returncode), stdout.decode(), stderr.decode()
+        )
+
+    async def _gather(self, cmds: List[Cmd]) -> List[subprocess.CompletedProcess]:
+        return await asyncio.gather(*(self._execute_async(cmd) for cmd in cmds))
+
+    def _execute_concurrently(self, commands: List[Command]) -> List[subprocess.CompletedProcess]:
+        """
+        Executes independent commands concurrently. Their output is captured and
+        logged once they've all exited, in the order they were given, which is
+        also the order in which they'll be rolled back.
+        """
+        for command in commands:
+            logger.info(f"--> {_format_cmd(command.commit)}")
+
+        # Not asyncio.run(): it leaves no current event loop behind, which
+        # subprocess_tee.run() (hence any later command or rollback) relies on.
+        loop = asyncio.new_event_loop()
+        try:
+            ps = loop.run_until_complete(self._gather([command.commit for command in commands]))
+        finally:
+            loop.close()
+
+        for command, p in zip(commands, ps):
+            for line in (p.stdout + p.stderr).splitlines():
+                logger.info(line)
+            # Like execute(), only commands that succeeded need a rollback.
+            if not command.pure and p.returncode == 0:
+                self._rollbackable.append(command)
+
+        for p in ps:
+            p.check_returncode()
+
+        return ps
+
+    def execute_concurrent_final(
+        self, cmds: List[Tuple[Cmd, Optional[Cmd]]]
+    ) -> List[subprocess.CompletedProcess]:
+        """
+        Executes (commit, rollback) commands concurrently, see
+        _execute_concurrently(). Meant for the last steps of the transaction,
+        e.g. independent uploads.
+        """
+        return self._execute_concurrently(
+            [Command(commit=commit, rollback=rollback, pure=False) for commit, rollback in cmds]
+        )
+
     def execute(
         self,
-        commit: str,
-        rollback: Optional[str] = None,
+        commit: Cmd,
+        rollback: Optional[Cmd] = None,
         pure: bool = False,
         check: bool = True,
     ) -> subprocess.CompletedProcess:
@@ -67,8 +133,8 @@ class Transaction:
             raise ValueError("cannot both be pure and have a rollback")
 
         p = self._execute(commit, check=check)
-        command = Command(commit=commit, rollback=rollback, pure=pure)
-        self._executed.append(command)
+        if not pure:
+            self._rollbackable.append(Command(commit=commit, rollback=rollback, pure=pure))
 
         return p
 
@@ -88,7 +154,9 @@ class Transaction:
 
         if exc_type is subprocess.CalledProcessError:
             exc_value = cast(subprocess.CalledProcessError, exc_value)
-            logger.warn(f"Command {exc_value.cmd!r} exited with status {exc_value.returncode}")
+            logger.warn(
+                f"Command {_format_cmd(exc_value.cmd)!r} exited with status {exc_value.returncode}"
+            )
         elif exc_type is Rollback:
             logger.warn(f"Script triggered rollback: {exc_value}")
         else:
@@ -97,28 +165,27 @@ class Transaction:
         logger.info("Rolling back transaction...")
         num_rollback_fails = 0
 
-        while self._executed:
-            command = self._executed.pop()
+        while self._rollbackable:
+            command = self._rollbackable.pop()
+            commit = _format_cmd(command.commit)
 
-            if command.pure:
-                logger.info(f"Command {command.commit!r} is pure, no rollback")
-            elif not command.rollback:
-                logger.error(f"Command {command.commit!r} has no rollback")
+            if not command.rollback:
+                logger.error(f"Command {commit!r} has no rollback")
             else:
                 try:
-                    logger.info(f"Rolling back command {command.commit!r}...")
+                    logger.info(f"Rolling back command {commit!r}...")
                     self._execute(command.rollback)
                 except BaseException as e:
                     if isinstance(e, subprocess.CalledProcessError):
                         logger.error(
-                            f"Rollback of command {command.commit!r} failed: "
-                            f"{command.rollback!r} exited with status {e.returncode}"
+                            f"Rollback of command {commit!r} failed: "
+                            f"{_format_cmd(command.rollback)!r} exited with status {e.returncode}"
                         )
                     else:
-                        logger.exception(f"Rollback of command {command.commit!r} failed:")
+                        logger.exception(f"Rollback of command {commit!r} failed:")
                     num_rollback_fails += 1
                 else:
-                    logger.info(f"Rollback of command {command.commit!r} succeeded")
+                    logger.info(f"Rollback of command {commit!r} succeeded")
 
         logger.info("Transaction rolled back")
         if num_rollback_fails:
@@ -128,32 +195,142 @@ class Transaction:
         return True
 
 
-def _setup_logging():
-    fh = logging.FileHandler(".release.log")
+class BufferedFileHandler(logging.FileHandler):
+    """
+    FileHandler that writes through a 64 KiB buffer and only flushes it for
+    errors and when the handler is closed, instead of after every record.
+    """
+
+    def _open(self):
+        return open(self.baseFilename, self.mode, buffering=65536, encoding=self.encoding)
+
+    def emit(self, record: logging.LogRecord):
+        # Same as StreamHandler.emit(), minus the unconditional flush.
+        if self.stream is None:
+            self.stream = self._open()
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+            if record.levelno >= logging.ERROR:
+                self.flush()
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+
+def _setup_logging() -> Callable[[], None]:
+    """
+    Returns the function stopping the logging, which is also called at exit.
+    """
+    # Disable third-party loggers, but not ours.
+    logging.config.dictConfig(
+        {
+            "version": 1,
+            "disable_existing_loggers": True,
+            "loggers": {logger.name: {}},
+        }
+    )
+
+    fh = BufferedFileHandler(".release.log", encoding="utf-8")
     fh.setFormatter(logging.Formatter("%(asctime)s [%(levelname)-8s] %(message)s"))
+    # Batch writes to the log file, which otherwise happen for every line of
+    # every command's output.
+    buffered_fh = MemoryHandler(
+        capacity=1024, flushLevel=logging.ERROR, target=fh, flushOnClose=True
+    )
 
     sh = logging.StreamHandler(sys.stderr)
     sh.setFormatter(logging.Formatter("[%(levelname)-8s] %(message)s"))
 
+    # Log records are only enqueued by the caller, and handled by a background
+    # thread so the main thread never waits on the terminal or the log file.
+    q: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    listener = QueueListener(q, sh, buffered_fh, respect_handler_level=True)
+    listener.start()
+
+    qh = QueueHandler(q)
+    # QueueHandler formats records before enqueuing them. Keep the bare message
+    # so that only the formats of the handlers above apply.
+    qh.setFormatter(logging.Formatter("%(message)s"))
     logging.basicConfig(
         level=logging.DEBUG,
-        handlers=[sh, fh],
+        handlers=[qh],
     )
 
     class LogWriter(TextIOBase):
-        def __init__(self, logger: logging.Logger):
+        """
+        Logs written lines in batches: a single record is emitted for every
+        max_lines lines, or max_delay_sec after the first pending line. Meant to
+        be shared by stdout and stderr so that their relative order is kept.
+        """
+
+        def __init__(
+            self, logger: logging.Logger, max_lines: int = 64, max_delay_sec: float = 0.05
+        ):
             self._logger = logger
+            self._max_lines = max_lines
+            self._max_delay_sec = max_delay_sec
+            self._buf: List[str] = []
+            # Reentrant, in case logging itself writes to stderr.
+            self._cond = threading.Condition(threading.RLock())
+            threading.Thread(target=self._flush_periodically, daemon=True).start()
 
         def write(self, message: str):
             stripped = message.rstrip("\n")
-            if stripped:  # For getpass().
-                self._logger.info(stripped)
+            if not stripped:  # For getpass().
+                return
+
+            with self._cond:
+                self._buf.append(stripped)
+                if len(self._buf) >= self._max_lines:
+                    self._flush()
+                elif len(self._buf) == 1:
+                    self._cond.notify()
 
         def flush(self):
-            pass
+            with self._cond:
+                self._flush()
+
+        def _flush(self):
+            # Must be called with self._cond held.
+            lines, self._buf = self._buf, []
+            if lines:
+                self._logger.info("\n".join(lines), extra={"log_writer": True})
+
+        def _flush_periodically(self):
+            with self._cond:
+                while True:
+                    self._cond.wait_for(lambda: self._buf)
+                    # Give the batch up to max_delay_sec to fill up.
+                    self._cond.wait(self._max_delay_sec)
+                    self._flush()
+
+    sys.stderr = sys.stdout = writer = LogWriter(logger)
+
+    def flush_pending_lines(record: logging.LogRecord) -> bool:
+        # Log the lines written so far before any other record, to keep them
+        # in order.
+        if not getattr(record, "log_writer", False):
+            writer.flush()
+        return True
 
-    sys.stderr = LogWriter(logger)
-    sys.stdout = LogWriter(logger)
+    qh.addFilter(flush_pending_lines)
+
+    stopped = False
+
+    def stop_logging():
+        """Waits for every pending line and record to be written, in order."""
+        nonlocal stopped
+        if stopped:
+            return
+        stopped = True
+        writer.flush()
+        listener.stop()
+        buffered_fh.flush()
+        fh.flush()
+
+    atexit.register(stop_logging)
+    return stop_logging
 
 
 if __name__ == "__main__":
@@ -172,14 +349,15 @@ if __name__ == "__main__":
         # Prerequisites:
 
         # Ensure we're on the main branch.
-        tx.execute(
-            '[ "$(git rev-parse --symbolic-full-name --abbrev-ref HEAD)" = "main" ]', pure=True
-        )
+        branch = _git_query(("rev-parse", "--symbolic-full-name", "--abbrev-ref", "HEAD"))
+        if branch.strip() != "main":
+            raise Rollback("not on the main branch")
         # Ensure the repo is clean.
-        tx.execute('[ -z "$(git status --porcelain)" ]', pure=True)
+        if _git_query(("status", "--porcelain")) != "":
+            raise Rollback("repo is not clean")
         # Ensure we're logged into the ghcr.io Docker repo.
         # TODO: Check if we have permission to push our image. Not sure how to do this.
-        tx.execute("docker login ghcr.io", pure=True)
+        tx.execute(["docker", "login", "ghcr.io"], pure=True)
         # Ensure the tests pass.
         tx.execute("PY_COLORS=1 tox -- --color=yes", pure=True)
 
@@ -187,12 +365,15 @@ if __name__ == "__main__":
 
         # Bump the version in pyproject.toml.
         p_poetry_version = tx.execute(
-            f"poetry version {quote(args.version)}",
-            rollback="git checkout HEAD -- pyproject.toml",
+            ["poetry", "version", args.version],
+            rollback=["git", "checkout", "HEAD", "--", "pyproject.toml"],
         )
 
         version = p_poetry_version.stdout.split()[-1]
-        assert re_semver.match(version), f"not a valid semver: {version}"
+        try:
+            Version(version)
+        except InvalidVersion:
+            raise AssertionError(f"not a valid version: {version}") from None
 
         confirm_version = input("Confirm new version? (y/N) ")
         if confirm_version.lower() in ("y", "yes"):
@@ -206,32 +387,32 @@ if __name__ == "__main__":
 
         # Commit pyproject.toml.
         tx.execute(
-            f'git commit -m "v{version} release" pyproject.toml',
-            rollback="git reset HEAD^",
+            ["git", "commit", "-m", f"v{version} release", "pyproject.toml"],
+            rollback=["git", "reset", "HEAD^"],
         )
 
         # Tag the commit.
         tx.execute(
-            f'git tag -a {git_tag} -m "v{version} release"',
-            rollback=f"git tag -d {git_tag}",
+            ["git", "tag", "-a", git_tag, "-m", f"v{version} release"],
+            rollback=["git", "tag", "-d", git_tag],
         )
 
         # Create the Docker image.
         tx.execute(
-            f"docker build -t {docker_tag_version} .",
-            rollback=f"docker rmi {docker_tag_version}",
+            ["docker", "build", "-t", docker_tag_version, "."],
+            rollback=["docker", "rmi", docker_tag_version],
         )
 
         # Ensure the tests pass inside the container.
         tx.execute(
-            f"docker run --rm --network host --entrypoint sh {docker_tag_version}"
-            f' -c ". /venv/bin/activate && python -m pytest"',
+            ["docker", "run", "--rm", "--network", "host", "--entrypoint", "sh"]
+            + [docker_tag_version, "-c", ". /venv/bin/activate && python -m pytest"],
             pure=True,
         )
 
         # Smoke test: ensure 'run' exits with status EXIT_UNAUTHORIZED.
         smoke_test = tx.execute(
-            f"docker run --rm --network host {docker_tag_version} run",
+            ["docker", "run", "--rm", "--network", "host", docker_tag_version, "run"],
             pure=True,
             check=False,
         )
@@ -244,8 +425,8 @@ if __name__ == "__main__":
         # Tag the image with "latest".
         # TODO: Reassign the latest tag to its original image in rollback?
         tx.execute(
-            f"docker tag {docker_tag_version} {docker_tag_latest}",
-            rollback=f"docker rmi {docker_tag_latest}",
+            ["docker", "tag", docker_tag_version, docker_tag_latest],
+            rollback=["docker", "rmi", docker_tag_latest],
         )
 
         # Publish on PyPI.
@@ -254,12 +435,17 @@ if __name__ == "__main__":
             f" --password {quote(pypi_password)}"
         )
 
-        # Publish on GitHub Container Registry.
-        tx.execute(f"docker push {docker_tag_version}")
-        tx.execute(f"docker push {docker_tag_latest}")
+        # Publish on GitHub Container Registry. These are independent uploads,
+        # so run them concurrently.
+        tx.execute_concurrent_final(
+            [
+                (["docker", "push", docker_tag_version], None),
+                (["docker", "push", docker_tag_latest], None),
+            ]
+        )
         # TODO: Delete older local tags?
 
-        # Push to git repo.
-        tx.execute("git push --follow-tags")
+        # Push to git repo. Last, since this can't be rolled back.
+        tx.execute(["git", "push", "--follow-tags"])
 
     sys.exit(int(not tx.committed))
@@ -1,18 +1,35 @@
 import logging
-from dataclasses import replace
-from typing import Optional, Set, Tuple, cast
+from typing import Dict, Optional, Set, Tuple, cast
 
 from .seekables import Seekable, SeekableNotFoundError, SeekableProvider
-from .sessions import EpisodeSession, Session, SessionExtrapolator, SessionListener
+from .sessions import (
+    EpisodeSession,
+    IntroMarker,
+    Session,
+    SessionExtrapolator,
+    SessionKey,
+    SessionListener,
+)
 
 logger = logging.getLogger(__name__)
 
+# Bounds for the delay between two extrapolations, in milliseconds. The upper
+# bound keeps us responsive to changes we wouldn't have been notified of yet.
+_MIN_EXTRAPOLATION_DELAY_MS = 100
+_MAX_EXTRAPOLATION_DELAY_MS = 5000
+# Used once there's no marker left ahead of the view offset.
+_DEFAULT_EXTRAPOLATION_DELAY_MS = 1000
+
 
 class AutoSkipper(SessionListener, SessionExtrapolator):
     def __init__(self, seekable_provider: SeekableProvider):
         self._sp = seekable_provider
-        self._skipped_intro: Set[Session] = set()
-        self._skipped_credits: Set[Session] = set()
+        self._skipped_intro: Set[SessionKey] = set()
+        self._skipped_credits: Set[SessionKey] = set()
+        # Session key -> (episode rating key, intro, pre-credits scene, ending).
+        self._marker_cache: Dict[SessionKey, Tuple[int, IntroMarker, IntroMarker, int]] = {}
+        # Session key -> (episode rating key, seekable).
+        self._seekable_cache: Dict[SessionKey, Tuple[int, Seekable]] = {}
 
     def trigger_extrapolation(self, session: Session, listener_accepted: bool) -> bool:
         # Note it's only useful to do this when the state is 'playing':
@@ -35,9 +52,22 @@ class AutoSkipper(SessionListener, SessionExtrapolator):
 
     def extrapolate(self, session: Session) -> Tuple[Session, int]:
         session = cast(EpisodeSession, session)  # Safe thanks to trigger_extrapolation().
-        delay_ms = 1000
-        new_view_offset_ms = session.view_offset_ms + delay_ms
-        return replace(session, view_offset_ms=new_view_offset_ms), delay_ms
+        view_offset_ms = session.view_offset_ms
+        intro_marker, pre_credits_scene_marker, ending_marker = self._get_markers(session)
+
+        # Nothing happens between two markers, so wake up at the next one.
+        upcoming = [
+            m
+            for m in (intro_marker.start, pre_credits_scene_marker.start, ending_marker)
+            if m > view_offset_ms
+        ]
+        if upcoming:
+            delay_ms = min(upcoming) - view_offset_ms
+            delay_ms = max(_MIN_EXTRAPOLATION_DELAY_MS, min(delay_ms, _MAX_EXTRAPOLATION_DELAY_MS))
+        else:
+            delay_ms = _DEFAULT_EXTRAPOLATION_DELAY_MS
+        new_view_offset_ms = view_offset_ms + delay_ms
+        return session.with_offset(new_view_offset_ms), delay_ms
 
     def accept_session(self, session: Session) -> bool:
         if not isinstance(session, EpisodeSession):
@@ -46,55 +76,81 @@ class AutoSkipper(SessionListener, SessionExtrapolator):
             return False
 
         if session.state != "playing":
-            logger.debug(f'Ignored; state is "{session.state}" instead of "playing"')
+            logger.debug('Ignored; state is "%s" instead of "playing"', session.state)
             return False
 
         return True
 
     def on_session_activity(self, session: Session):
         session = cast(EpisodeSession, session)  # Safe thanks to accept_session().
-        logger.debug(f"session_activity: {session}")
-
-        intro_marker = session.intro_marker()
-        pre_credits_scene_marker = session.pre_credits_scene_marker()
-        ending_marker = session.ending_marker()
+        skey = session.key
         view_offset_ms = session.view_offset_ms
-
-        logger.debug(f"session.key={session.key}")
-        logger.debug(f"session.view_offset_ms={session.view_offset_ms}")
-        logger.debug(f"intro_marker={intro_marker}")
-        logger.debug(f"pre_credits_scene_marker={pre_credits_scene_marker}")
-        logger.debug(f"ending_marker={ending_marker}")
-
-        if intro_marker.start <= view_offset_ms < intro_marker.end:
+        intro_marker, pre_credits_scene_marker, ending_marker = self._get_markers(session)
+        istart, iend = intro_marker
+        pstart, pend = pre_credits_scene_marker
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"session_activity: {session}")
+            logger.debug(f"session.key={skey}")
+            logger.debug(f"session.view_offset_ms={view_offset_ms}")
+            logger.debug(f"intro_marker={intro_marker}")
+            logger.debug(f"pre_credits_scene_marker={pre_credits_scene_marker}")
+            logger.debug(f"ending_marker={ending_marker}")
+
+        # At most one of these applies, and the seekable is only looked up
+        # (which may hit the network) once we know it does.
+        if istart <= view_offset_ms < iend and skey not in self._skipped_intro:
             seekable = self._get_seekable(session=session)
             if seekable:
-                if session not in self._skipped_intro:
-                    seekable.seek(intro_marker.end)
-                    self._skipped_intro.add(session)
-                    logger.info(
-                        f"Session {session.key}: skipped intro (seeked from {view_offset_ms} to {intro_marker.end})"  # noqa: E501
-                    )
-        if pre_credits_scene_marker.start <= view_offset_ms < pre_credits_scene_marker.end:
+                seekable.seek(iend)
+                self._skipped_intro.add(skey)
+                logger.info(
+                    f"Session {skey}: skipped intro (seeked from {view_offset_ms} to {iend})"
+                )
+        elif pstart <= view_offset_ms < pend and skey not in self._skipped_credits:
             seekable = self._get_seekable(session=session)
             if seekable:
-                if session not in self._skipped_credits:
-                    seekable.seek(pre_credits_scene_marker.end)
-                    self._skipped_credits.add(session)
-                    logger.info(
-                        f"Session {session.key}: skipped credits (seeked from {view_offset_ms} to {intro_marker.end})"  # noqa: E501
-                    )
-        if view_offset_ms >= ending_marker:
+                seekable.seek(pend)
+                self._skipped_credits.add(skey)
+                logger.info(
+                    f"Session {skey}: skipped credits (seeked from {view_offset_ms} to {pend})"
+                )
+        elif view_offset_ms >= ending_marker:
             seekable = self._get_seekable(session=session)
             if seekable:
                 seekable.skip_next()
-                logger.info(f"Session {session.key}: skipped to next item")
+                logger.info(f"Session {skey}: skipped to next item")
 
         logger.debug("-----")
 
-    def _get_seekable(self, session: Session) -> Optional[Seekable]:
+    def _get_markers(self, session: EpisodeSession) -> Tuple[IntroMarker, IntroMarker, int]:
+        # The markers only depend on the episode, which may change while the
+        # session key stays the same (e.g. after skipping to the next item).
+        rating_key = session.playable.ratingKey
+        cached = self._marker_cache.get(session.key)
+        if cached is None or cached[0] != rating_key:
+            cached = (
+                rating_key,
+                session.intro_marker(),
+                session.pre_credits_scene_marker(),
+                session.ending_marker(),
+            )
+            self._marker_cache[session.key] = cached
+        return cached[1], cached[2], cached[3]
+
+    def _get_seekable(self, session: EpisodeSession) -> Optional[Seekable]:
+        # Like the markers, only reuse the seekable for the same episode, so
+        # that it gets looked up again from time to time (e.g. in case the
+        # player stopped advertising itself, or the Chromecast was rediscovered).
+        rating_key = session.playable.ratingKey
+        cached = self._seekable_cache.get(session.key)
+        if cached is not None and cached[0] == rating_key:
+            return cached[1]
+
+        # Failures aren't cached: the player may become reachable later on,
+        # e.g. once "advertise as player" gets enabled.
         try:
-            return self._sp.provide_seekable(session)
+            seekable = self._sp.provide_seekable(session)
         except SeekableNotFoundError as e:
             if e.has_plex_player_not_found():
                 logger.error(
@@ -103,6 +159,11 @@ class AutoSkipper(SessionListener, SessionExtrapolator):
             logger.exception(f"Cannot skip to next item for session {session.key}")
             return None
 
+        self._seekable_cache[session.key] = (rating_key, seekable)
+        return seekable
+
     def on_session_removal(self, session: Session):
-        self._skipped_intro.discard(session)
-        self._skipped_credits.discard(session)
+        self._skipped_intro.discard(session.key)
+        self._skipped_credits.discard(session.key)
+        self._marker_cache.pop(session.key, None)
+        self._seekable_cache.pop(session.key, None)
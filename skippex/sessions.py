@@ -67,6 +67,16 @@ class EpisodeSession(Session):
             view_offset_ms=int(episode.viewOffset),
         )
 
+    def with_offset(self, view_offset_ms: int) -> "EpisodeSession":
+        """
+        Returns a copy of this session with the specified view offset. Cheaper
+        than dataclasses.replace() since it doesn't go through __init__().
+        """
+        new = object.__new__(type(self))
+        new.__dict__.update(self.__dict__)
+        object.__setattr__(new, "view_offset_ms", view_offset_ms)  # Frozen dataclass.
+        return new
+
     def intro_marker(self) -> IntroMarker:
         for marker in (m for m in self.playable.markers if m.type == "intro"):
             if marker.end < self.playable.duration / 2:
@@ -233,7 +243,7 @@ class SessionDiscovery:
         self._timers.pop(session.key, None)
 
         if not self._extrapolator.trigger_extrapolation(session, accepted):
-            logger.debug(f"Will not extrapolate session {session}")
+            logger.debug("Will not extrapolate session %s", session)
             return
 
         assert session.key not in self._timers
@@ -248,9 +258,12 @@ class SessionDiscovery:
         new_timer.start()
         self._timers[new_session.key] = new_timer
 
+        # Lazy formatting: the sessions' reprs are costly and this runs on every tick.
         logger.debug(
-            f"Timer (delay={delay_sec:.3f}s) started for extrapolated session "
-            f"{new_session} (original: {session})"
+            "Timer (delay=%.3fs) started for extrapolated session %s (original: %s)",
+            delay_sec,
+            new_session,
+            session,
         )
 
     @synchronized
@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+from plexapi.client import PlexClient
+from plexapi.video import Episode
+import pytest
+
+from skippex.core import AutoSkipper
+from skippex.seekables import Seekable, SeekableProvider
+from skippex.sessions import EpisodeSession
+
+
+def make_fake_episode_session(view_offset_ms: int, rating_key: int = 1) -> EpisodeSession:
+    # One hour long, with an intro at [10s, 60s) and a pre-credits scene at
+    # [3003s, 3098s) once the markers' offsets are applied. Ends at 3597s.
+    episode = Mock(spec=Episode)
+    episode.ratingKey = rating_key
+    episode.duration = 3_600_000
+    episode.markers = [
+        SimpleNamespace(type="intro", start=7_000, end=60_000),
+        SimpleNamespace(type="intro", start=3_000_000, end=3_100_000),
+    ]
+    return EpisodeSession(
+        key="1",
+        state="playing",
+        playable=episode,
+        player=Mock(spec=PlexClient),
+        view_offset_ms=view_offset_ms,
+    )
+
+
+class TestAutoSkipper:
+    @pytest.mark.parametrize(
+        "view_offset_ms, expected_delay_ms",
+        [
+            # Next marker (intro start) 2s ahead.
+            (8_000, 2_000),
+            # Next marker (intro start) 50ms ahead, clamped up.
+            (9_950, 100),
+            # Next marker (pre-credits scene start) way ahead, clamped down.
+            (60_000, 5_000),
+            # Past the ending marker, fallback delay.
+            (3_598_000, 1_000),
+        ],
+    )
+    def test_extrapolate(self, view_offset_ms: int, expected_delay_ms: int):
+        skipper = AutoSkipper(Mock(spec=SeekableProvider))
+        session = make_fake_episode_session(view_offset_ms)
+
+        new_session, delay_ms = skipper.extrapolate(session)
+
+        assert delay_ms == expected_delay_ms
+        assert isinstance(new_session, EpisodeSession)
+        assert new_session.view_offset_ms == view_offset_ms + expected_delay_ms
+
+    def test_seekable_cache(self):
+        provider = Mock(spec=SeekableProvider)
+        provider.provide_seekable.return_value = Mock(spec=Seekable)
+        skipper = AutoSkipper(provider)
+
+        # Skip the intro, then the pre-credits scene of the same episode.
+        skipper.on_session_activity(make_fake_episode_session(20_000))
+        skipper.on_session_activity(make_fake_episode_session(3_050_000))
+        assert provider.provide_seekable.call_count == 1
+
+        # Invalidated by the session's removal.
+        skipper.on_session_removal(make_fake_episode_session(3_050_000))
+        skipper.on_session_activity(make_fake_episode_session(20_000))
+        assert provider.provide_seekable.call_count == 2
+
+        # Invalidated by the next episode playing under the same session key.
+        skipper.on_session_activity(make_fake_episode_session(3_050_000, rating_key=2))
+        assert provider.provide_seekable.call_count == 3
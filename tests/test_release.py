@@ -0,0 +1,82 @@
+import io
+import logging
+import logging.config
+from pathlib import Path
+import re
+import sys
+from typing import Callable, Iterator, NamedTuple, TextIO
+
+import pytest
+
+# release.py is a development script, it isn't shipped in the Docker image.
+release = pytest.importorskip("release")
+
+
+@pytest.fixture
+def terminal(monkeypatch: pytest.MonkeyPatch) -> io.StringIO:
+    """Stands for the terminal the release script's logs are written to."""
+    stream = io.StringIO()
+    # Both are replaced by _setup_logging(), restore them afterwards.
+    monkeypatch.setattr(sys, "stderr", stream)
+    monkeypatch.setattr(sys, "stdout", sys.stdout)
+    return stream
+
+
+class ReleaseLogging(NamedTuple):
+    stop: Callable[[], None]
+    # What sys.stdout and sys.stderr are replaced with. Pytest's capture puts
+    # them back while a test runs, so tests have to write to it explicitly.
+    writer: TextIO
+
+
+@pytest.fixture
+def release_logging(
+    terminal: io.StringIO, monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> Iterator[ReleaseLogging]:
+    """Sets up the release script's logging in tmp_path."""
+    monkeypatch.chdir(tmp_path)
+    # Don't disable the loggers of the other tests.
+    monkeypatch.setattr(logging.config, "dictConfig", lambda config: None)
+
+    root = logging.getLogger()
+    handlers, level = root.handlers, root.level
+    root.handlers = []  # basicConfig() does nothing otherwise.
+    try:
+        stop = release._setup_logging()
+        yield ReleaseLogging(stop=stop, writer=sys.stdout)
+        stop()
+    finally:
+        root.handlers = handlers
+        root.setLevel(level)
+
+
+class TestSetupLogging:
+    def test_format(
+        self, release_logging: ReleaseLogging, terminal: io.StringIO, tmp_path: Path
+    ):
+        release.logger.info("--> true")
+        release_logging.stop()
+
+        assert terminal.getvalue() == "[INFO    ] --> true\n"
+        log = (tmp_path / ".release.log").read_text()
+        assert re.fullmatch(r"\S+ \S+ \[INFO    \] --> true\n", log)
+
+    def test_output_order(self, release_logging: ReleaseLogging, terminal: io.StringIO):
+        print("before", file=release_logging.writer)
+        release.logger.info("--> true")
+        print("after", file=release_logging.writer)
+        release_logging.stop()
+
+        assert terminal.getvalue() == "[INFO    ] before\n[INFO    ] --> true\n[INFO    ] after\n"
+
+
+class TestTransaction:
+    def test_rollback_after_failed_concurrent_command(self, tmp_path: Path):
+        rolled_back = tmp_path / "rolled_back"
+
+        with release.Transaction() as tx:
+            tx.execute(["true"], rollback=["touch", str(rolled_back)])
+            tx.execute_concurrent_final([(["true"], None), (["false"], None)])
+
+        assert tx.committed is False
+        assert rolled_back.exists()
@@ -4,11 +4,13 @@ from unittest.mock import Mock
 from plexapi.base import Playable
 from plexapi.client import PlexClient
 from plexapi.server import PlexServer
+from plexapi.video import Episode
 import pytest
 from typing_extensions import Literal
 
 from skippex.notifications import PlaybackNotification
 from skippex.sessions import (
+    EpisodeSession,
     Session,
     SessionDiscovery,
     SessionDispatcher,
@@ -114,6 +116,26 @@ class TestSession:
         assert (a == b) is is_same
 
 
+class TestEpisodeSession:
+    def test_with_offset(self):
+        session = EpisodeSession(
+            key="1",
+            state="playing",
+            playable=Mock(spec=Episode),
+            player=Mock(spec=PlexClient),
+            view_offset_ms=1000,
+        )
+        new_session = session.with_offset(2000)
+
+        assert new_session.view_offset_ms == 2000
+        assert session.view_offset_ms == 1000
+        assert type(new_session) is EpisodeSession
+        assert new_session == session
+        assert new_session.state == session.state
+        assert new_session.playable is session.playable
+        assert new_session.player is session.player
+
+
 class TestSessionDispatcher:
     def test_dispatch(
         self,